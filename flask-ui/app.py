@@ -1,12 +1,45 @@
 
-from flask import Flask, render_template_string, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory, stream_with_context
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
+import io
 import os
+import hashlib
 import shutil
+import tempfile
+import threading
 from werkzeug.utils import secure_filename
-from urllib.parse import unquote
+from markupsafe import Markup
 from PIL import Image
 import numpy as np
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import MappingProxyType
+from collections import OrderedDict
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_GRAY
+    jpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    # PyTurboJPEG or the libturbojpeg shared library is unavailable; use Pillow only
+    jpeg = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.info("Decoding ELA JPEGs with %s", "libjpeg-turbo" if jpeg is not None else "Pillow")
 
 app = Flask(__name__)
 UPLOAD_FOLDER = './images'
@@ -14,57 +47,36 @@ STATIC_FOLDER = './static'
 os.makedirs(STATIC_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-HTML = '''
+# Keep-alive connection pool for calls to foto-forensics
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# ELA reports of recent uploads, keyed by a digest of the uploaded bytes and kept in
+# least-recently-used order; each entry also records the ELA image path and mtime
+ELA_REPORTS = OrderedDict()
+ELA_REPORTS_MAX = 256
+ELA_REPORTS_LOCK = threading.Lock()
+
+# Report shown until an upload has been analyzed; copied and adjusted per request
+DEFAULT_ELA_REPORT = MappingProxyType({
+    "description": "No analysis performed yet.", "result": "Unknown", "certainty": 0,
+    "ela_mean": 0, "ela_std": 0, "dimensions": "Unknown", "file_size": "Unknown",
+    "high_variance_percent": 0, "edge_density": 0
+})
+
+HTML_HEAD = '''
 <!doctype html>
 <html>
 <head>
 <title>Image Authenticity Toolkit</title>
-<style>
-body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
-.container { max-width: 1200px; margin: 0 auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-h1 { color: #333; border-bottom: 2px solid #007bff; padding-bottom: 10px; }
-.upload-section { background: #f8f9fa; padding: 20px; border-radius: 5px; margin-bottom: 20px; }
-.upload-form input[type="file"] { margin-right: 10px; padding: 5px; }
-.upload-form input[type="submit"] { background: #007bff; color: white; padding: 8px 16px; border: none; border-radius: 4px; cursor: pointer; }
-.upload-form input[type="submit"]:hover { background: #0056b3; }
-.error { color: #dc3545; font-weight: bold; background: #f8d7da; padding: 10px; border-radius: 4px; margin: 10px 0; }
-.results-container { display: flex; gap: 30px; margin-top: 20px; }
-.image-section { flex: 1; }
-.analysis-section { flex: 1; background: #f8f9fa; padding: 20px; border-radius: 5px; }
-.result-badge { display: inline-block; padding: 5px 10px; border-radius: 15px; font-weight: bold; margin: 5px 0; }
-.authentic { background: #d4edda; color: #155724; }
-.manipulated { background: #f8d7da; color: #721c24; }
-.unknown { background: #d1ecf1; color: #0c5460; }
-.non-authentic { background: #f8d7da; color: #721c24; }
-.suspicious { background: #fff3cd; color: #856404; }
-.likely-manipulated { background: #f8d7da; color: #721c24; }
-.confidence-bar { width: 100%; height: 20px; background: #e9ecef; border-radius: 10px; overflow: hidden; margin: 10px 0; }
-.confidence-fill { height: 100%; transition: width 0.3s ease; }
-.confidence-high { background: linear-gradient(90deg, #28a745, #20c997); }
-.confidence-medium { background: linear-gradient(90deg, #ffc107, #fd7e14); }
-.confidence-low { background: linear-gradient(90deg, #dc3545, #e83e8c); }
-.metrics-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 15px; margin: 15px 0; }
-.metric-card { background: white; padding: 15px; border-radius: 5px; border-left: 4px solid #007bff; }
-.metric-label { font-size: 12px; color: #666; text-transform: uppercase; }
-.metric-value { font-size: 18px; font-weight: bold; color: #333; }
-.export-section { margin-top: 20px; padding-top: 15px; border-top: 1px solid #dee2e6; }
-.export-btn { background: #28a745; color: white; padding: 8px 16px; border: none; border-radius: 4px; cursor: pointer; margin-right: 10px; text-decoration: none; display: inline-block; }
-.export-btn:hover { background: #218838; }
-.analysis-tabs { margin: 20px 0; }
-.analysis-method { background: white; margin: 10px 0; padding: 15px; border-radius: 5px; border-left: 4px solid #007bff; }
-.analysis-method h4 { margin: 0 0 10px 0; color: #333; }
-.overall-result { text-align: center; margin: 20px 0; padding: 20px; background: #f8f9fa; border-radius: 5px; }
-.tab-content { display: grid; grid-template-columns: 1fr 1fr; gap: 15px; }
-.comprehensive-section { background: #f8f9fa; padding: 20px; border-radius: 5px; margin-top: 20px; }
-.method-score { font-weight: bold; color: #007bff; }
-.indicator-list { margin: 10px 0; padding-left: 20px; }
-.indicator-list li { margin: 5px 0; color: #dc3545; }
-</style>
+<link rel="stylesheet" href="{{ url_for('static', filename='app.css') }}">
 </head>
 <body>
 <div class="container">
 <h1>🔍 Image Authenticity Toolkit</h1>
-<div class="upload-section">
+'''
+
+HTML_BODY = '''<div class="upload-section">
   <h3>Upload Image for Analysis</h3>
   {% if error %}
     <div class="error">Error: {{ error }}</div>
@@ -81,9 +93,9 @@ h1 { color: #333; border-bottom: 2px solid #007bff; padding-bottom: 10px; }
     <h2>📊 Analysis Results: {{ filename }}</h2>
     <div style="text-align: center;">
       <h4>Original Image</h4>
-      <img src="{{ url_for('serve_ela_image', filename=filename) }}" style="max-width: 100%; height: auto; border: 1px solid #ddd; border-radius: 4px; margin-bottom: 20px;">
+      <img src="{{ url_for('serve_ela_image', filename=filename, v=original_version) }}" style="max-width: 100%; height: auto; border: 1px solid #ddd; border-radius: 4px; margin-bottom: 20px;">
       <h4>ELA Analysis</h4>
-      <img src="{{ url_for('serve_ela_image', filename='ela_' + filename) }}" style="max-width: 100%; height: auto; border: 1px solid #ddd; border-radius: 4px;">
+      <img src="{{ url_for('serve_ela_image', filename='ela_' + filename, v=image_version) }}" style="max-width: 100%; height: auto; border: 1px solid #ddd; border-radius: 4px;">
       <p style="font-size: 12px; color: #666; margin-top: 10px;">
         ELA (Error Level Analysis) highlights areas with different compression levels, which may indicate manipulation.
       </p>
@@ -312,54 +324,8 @@ h1 { color: #333; border-bottom: 2px solid #007bff; padding-bottom: 10px; }
   </div>
 </div>
 
-<script>
-function downloadReport(format) {
-    {% if comprehensive_analysis %}
-    const reportData = {
-        filename: "{{ filename }}",
-        timestamp: new Date().toISOString(),
-        comprehensive_analysis: {{ comprehensive_analysis|tojson }},
-        ela_analysis: {
-            result: "{{ ela_report.result }}",
-            certainty: {{ ela_report.certainty }},
-            description: "{{ ela_report.description }}",
-            ela_mean: {{ ela_report.ela_mean }},
-            ela_std: {{ ela_report.ela_std }},
-            dimensions: "{{ ela_report.dimensions }}",
-            file_size: "{{ ela_report.file_size }}",
-            high_variance_percent: {{ ela_report.high_variance_percent }},
-            edge_density: {{ ela_report.edge_density }}
-        }
-    };
-    {% else %}
-    const reportData = {
-        filename: "{{ filename }}",
-        timestamp: new Date().toISOString(),
-        ela_analysis: {
-            result: "{{ ela_report.result }}",
-            certainty: {{ ela_report.certainty }},
-            description: "{{ ela_report.description }}",
-            ela_mean: {{ ela_report.ela_mean }},
-            ela_std: {{ ela_report.ela_std }},
-            dimensions: "{{ ela_report.dimensions }}",
-            file_size: "{{ ela_report.file_size }}",
-            high_variance_percent: {{ ela_report.high_variance_percent }},
-            edge_density: {{ ela_report.edge_density }}
-        }
-    };
-    {% endif %}
-    
-    if (format === 'json') {
-        const blob = new Blob([JSON.stringify(reportData, null, 2)], {type: 'application/json'});
-        const url = URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        a.download = 'image_analysis_report_{{ filename }}.json';
-        a.click();
-        URL.revokeObjectURL(url);
-    } else if (format === 'txt') {
-        {% if comprehensive_analysis %}
-        const summary = `Comprehensive Image Authentication Report
+<script id="report-data" type="application/json">{"filename": {{ filename|tojson }}, "comprehensive_analysis": {{ comprehensive_analysis_json if comprehensive_analysis else 'null' }}, "ela_report": {{ ela_report|tojson }}}</script>
+<script id="report-summary" type="text/plain">{% if comprehensive_analysis %}Comprehensive Image Authentication Report
 ==========================================
 File: {{ filename }}
 Overall Result: {{ comprehensive_analysis.overall_result.replace('_', ' ') }}
@@ -387,10 +353,7 @@ Analysis Methods:
 - Blockchain Timestamp: {{ comprehensive_analysis.blockchain_analysis.blockchain_score }}%
 - ELA Analysis: {{ ela_report.certainty }}%
 
-Generated: ${new Date().toLocaleString()}
-`;
-        {% else %}
-        const summary = `Image Authentication Report
+{% else %}Image Authentication Report
 ========================
 File: {{ filename }}
 Result: {{ ela_report.result }}
@@ -405,142 +368,340 @@ Technical Metrics:
 - High Variance Pixels: {{ "%.1f"|format(ela_report.high_variance_percent) }}%
 - Edge Density: {{ "%.2f"|format(ela_report.edge_density) }}
 
-Generated: ${new Date().toLocaleString()}
-`;
-        {% endif %}
-        
-        const blob = new Blob([summary], {type: 'text/plain'});
-        const url = URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        a.download = 'image_analysis_summary_{{ filename }}.txt';
-        a.click();
-        URL.revokeObjectURL(url);
-    }
-}
-</script>
+{% endif %}</script>
+<script src="{{ url_for('static', filename='app.js') }}"></script>
 {% endif %}
 </div>
 </body>
 </html>
 '''
 
+# Compile the page once; app.jinja_env keeps url_for and HTML autoescaping available
+TEMPLATE = app.jinja_env.from_string(HTML_HEAD + HTML_BODY)
+# Uploads stream the head first and render the body once analysis is done
+HEAD_TEMPLATE = app.jinja_env.from_string(HTML_HEAD)
+BODY_TEMPLATE = app.jinja_env.from_string(HTML_BODY)
+
+def render_page(template, **context):
+    """Render a precompiled template with the same context render_template_string would add"""
+    app.update_template_context(context)
+    return template.render(context)
+
+def load_grayscale(path):
+    """Decode an image straight to a 2-D uint8 grayscale array"""
+    if jpeg is not None:
+        try:
+            with open(path, 'rb') as fh:
+                return jpeg.decode(fh.read(), pixel_format=TJPF_GRAY)[:, :, 0]
+        except OSError:
+            pass  # Not a JPEG (e.g. PNG ELA output); fall back to Pillow
+    with Image.open(path) as img:
+        # Grayscale images are wrapped as decoded; convert() would only add a copy
+        if img.mode != 'L':
+            img = img.convert('L')
+        return np.asarray(img)
+
+def read_dimensions(data):
+    """Return (width, height) of an encoded image held in memory, parsing only its header"""
+    if jpeg is not None:
+        try:
+            width, height, _, _ = jpeg.decode_header(data)
+            return width, height
+        except OSError:
+            pass
+    # Pillow only parses the header on open; pixel data is never decoded here
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+if njit is not None:
+    @njit(cache=True, nogil=True, fastmath=True, parallel=True)
+    def ela_sums(a):
+        """Single pass over the ELA array: pixel sum, sum of squares and neighbour differences"""
+        height, width = a.shape
+        total = 0
+        total_sq = 0
+        edges = 0
+        for i in prange(height):
+            row = a[i]
+            # The first row is compared with itself, so the inner loop needs no boundary branches
+            above = a[i - 1] if i > 0 else row
+            v = np.int64(row[0])
+            row_sum = v
+            row_sq = v * v
+            row_edges = abs(v - np.int64(above[0]))
+            for j in range(1, width):
+                v = np.int64(row[j])
+                row_sum += v
+                row_sq += v * v
+                row_edges += abs(v - np.int64(above[j])) + abs(v - np.int64(row[j - 1]))
+            total += row_sum
+            total_sq += row_sq
+            edges += row_edges
+        return total, total_sq, edges
+
+    @njit(cache=True, nogil=True, fastmath=True, parallel=True)
+    def count_above(a, threshold):
+        height, width = a.shape
+        count = 0
+        for i in prange(height):
+            row_count = 0
+            for j in range(width):
+                if a[i, j] > threshold:
+                    row_count += 1
+            count += row_count
+        return count
+
+def ela_statistics(ela_arr):
+    """Return (mean, std, high variance percent, edge density) of a grayscale ELA array"""
+    size = ela_arr.size
+    if njit is not None:
+        total, total_sq, edges = ela_sums(ela_arr)
+        mean_val = total / size
+        std_val = max(total_sq / size - mean_val * mean_val, 0.0) ** 0.5
+        high_variance_pixels = count_above(ela_arr, mean_val + std_val)
+    else:
+        # One pass builds a 256-bin histogram; mean, std and the threshold count follow from it
+        hist = np.bincount(ela_arr.ravel(), minlength=256)
+        levels = np.arange(256)
+        mean_val = (hist * levels).sum() / size
+        std_val = np.sqrt((hist * (levels - mean_val) ** 2).sum() / size)
+        high_variance_pixels = hist[int(mean_val + std_val) + 1:].sum()
+        # Neighbour differences go straight from uint8 into one reused int16 buffer
+        height, width = ela_arr.shape
+        buf = np.empty(ela_arr.size, dtype=np.int16)
+        vertical = buf[:(height - 1) * width].reshape(height - 1, width)
+        np.subtract(ela_arr[1:], ela_arr[:-1], out=vertical, dtype=np.int16)
+        edges = int(np.abs(vertical, out=vertical).sum())
+        horizontal = buf[:height * (width - 1)].reshape(height, width - 1)
+        np.subtract(ela_arr[:, 1:], ela_arr[:, :-1], out=horizontal, dtype=np.int16)
+        edges += int(np.abs(horizontal, out=horizontal).sum())
+    high_variance_percent = (high_variance_pixels / size) * 100
+    edge_density = edges / size
+    # Plain floats keep the scalar confidence math off NumPy's slower scalar types
+    return float(mean_val), float(std_val), float(high_variance_percent), float(edge_density)
+
+def warm_up():
+    """Compile the kernels when a worker starts so the first upload does not pay the JIT cost"""
+    ela_statistics(np.zeros((2, 2), dtype=np.uint8))
+
+def analyze_ela(ela_path, width, height, file_size):
+    """Build the ELA report for an upload; runs in a worker process"""
+    ela_arr = load_grayscale(ela_path)
+    mean_val, std_val, high_variance_percent, edge_density = ela_statistics(ela_arr)
+    
+    file_size_str = f"{file_size / 1024:.1f} KB" if file_size < 1024*1024 else f"{file_size / (1024*1024):.1f} MB"
+    
+    base_confidence = 50
+    mean_factor = min(40, (mean_val / 255) * 100)
+    std_factor = min(20, (std_val / 50) * 20)
+    variance_factor = min(20, high_variance_percent * 2)
+    
+    if mean_val > 15:
+        result = "Manipulated"
+        certainty = min(100, int(base_confidence + mean_factor + std_factor + variance_factor))
+        description = f"Analysis indicates potential manipulation. ELA shows bright areas (mean: {mean_val:.1f}) suggesting inconsistent compression levels. High variance regions ({high_variance_percent:.1f}%) and edge artifacts support this assessment."
+    else:
+        result = "Authentic"
+        certainty = max(30, int(100 - mean_factor - (std_factor/2) - (variance_factor/2)))
+        description = f"Analysis suggests the image is likely authentic. ELA shows mostly uniform compression (mean: {mean_val:.1f}) with low variance regions ({high_variance_percent:.1f}%), indicating consistent processing throughout the image."
+    
+    return {
+        "description": description,
+        "result": result,
+        "certainty": certainty,
+        "ela_mean": mean_val,
+        "ela_std": std_val,
+        "dimensions": f"{width} × {height}",
+        "file_size": file_size_str,
+        "high_variance_percent": high_variance_percent,
+        "edge_density": edge_density
+    }
+
+# ELA decoding and statistics are CPU bound; run them in worker processes so they
+# neither block other requests on the GIL nor share Numba's thread pool between threads
+POOL = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=warm_up)
+POOL_LOCK = threading.Lock()
+# Disk writes and the two foto-forensics calls of an upload run side by side
+IO_POOL = ThreadPoolExecutor(max_workers=16)
+
+# mkstemp creates files readable by the owner only; uploads get the mode a plain open() would give.
+# os.umask can only be read by setting it, so it is read once at startup.
+UMASK = os.umask(0)
+os.umask(UMASK)
+UPLOAD_MODE = 0o666 & ~UMASK
+
+def run_in_pool(fn, *args):
+    """Run fn in the process pool, replacing the pool once if a dead worker has broken it"""
+    global POOL
+    pool = POOL
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        with POOL_LOCK:
+            # Another request may already have replaced it
+            if POOL is pool:
+                logger.warning("ELA process pool broke; starting a new one")
+                pool.shutdown(wait=False)
+                POOL = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=warm_up)
+            pool = POOL
+        return pool.submit(fn, *args).result()
+
+def write_upload(data, filepath):
+    """Write the upload beside its final path and rename it in, so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+            os.fchmod(out.fileno(), UPLOAD_MODE)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def lookup_ela_report(digest):
+    """Return the cached (report, ela_path, version) for an upload digest, or None"""
+    with ELA_REPORTS_LOCK:
+        entry = ELA_REPORTS.get(digest)
+        if entry is not None:
+            ELA_REPORTS.move_to_end(digest)
+        return entry
+
+def store_ela_report(digest, report, ela_path, version):
+    """Cache a report, evicting the least recently used one when full"""
+    with ELA_REPORTS_LOCK:
+        ELA_REPORTS[digest] = (report, ela_path, version)
+        ELA_REPORTS.move_to_end(digest)
+        if len(ELA_REPORTS) > ELA_REPORTS_MAX:
+            ELA_REPORTS.popitem(last=False)
+
+def ela_version(ela_path):
+    """Return the ELA image's mtime, which versions its URL, or None if it does not exist"""
+    try:
+        return os.stat(ela_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def script_safe_json(text):
+    """Escape a JSON document for a <script> block the way the tojson filter does"""
+    return Markup(text.strip().replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026').replace("'", '\\u0027'))
+
+def forward_file(url, data, filename):
+    """POST the uploaded bytes to foto-forensics as a multipart form"""
+    body = MultipartEncoder(fields={'file': (filename, data), 'filename': filename})
+    return SESSION.post(url, data=body, headers={'Content-Type': body.content_type})
+
 @app.route('/ela_images/<path:filename>')
 def serve_ela_image(filename):
-    from urllib.parse import unquote
-    import os
-    decoded = unquote(filename)
-    full_path = os.path.join(app.config['UPLOAD_FOLDER'], decoded)
-    print(f"[DEBUG] Requested: {filename}", flush=True)
-    print(f"[DEBUG] Decoded: {decoded}", flush=True)
-    print(f"[DEBUG] Full path: {full_path}", flush=True)
-    print(f"[DEBUG] Exists: {os.path.exists(full_path)}", flush=True)
-    return send_from_directory(app.config['UPLOAD_FOLDER'], decoded)
+    # Image URLs carry a ?v= version, so the browser may cache them and revalidate via ETag
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True, max_age=3600)
+    response.cache_control.public = True
+    return response
 
-@app.route('/', methods=['GET', 'POST'])
-def upload_file():
+def analyze_upload(upload_name=None, data=None):
+    """Save the posted file's bytes, run the analyses and return the page context"""
     filename = None
     error = None
     comprehensive_analysis = None
-    ela_report = {"description": "No analysis performed yet.", "result": "Unknown", "certainty": 0, 
-                 "ela_mean": 0, "ela_std": 0, "dimensions": "Unknown", "file_size": "Unknown",
-                 "high_variance_percent": 0, "edge_density": 0}
-    if request.method == 'POST':
-        f = request.files['file']
-        base_filename = os.path.basename(f.filename)
-        safe_filename = secure_filename(base_filename)
+    comprehensive_analysis_json = None
+    image_version = None
+    original_version = None
+    ela_report = dict(DEFAULT_ELA_REPORT)
+    if data is not None:
+        safe_filename = secure_filename(upload_name)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
-        try:
-            f.save(filepath)
-            print(f"[INFO] Saved uploaded file to {filepath}", flush=True)
-        except Exception as e:
-            error = f"Failed to save uploaded file: {e}"
-            print(f"[ERROR] {error}", flush=True)
-            return render_template_string(HTML, filename=None, error=error)
+        upload_digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        saved = IO_POOL.submit(write_upload, data, filepath)
+        ela_path = os.path.join(app.config['UPLOAD_FOLDER'], f'ela_{safe_filename}')
+        cached = lookup_ela_report(upload_digest)
+        # The ELA image left by an earlier upload of the same bytes and name makes /upload redundant
+        ela_current = cached is not None and cached[1] == ela_path and ela_version(ela_path) == cached[2]
+        # /analyze and /upload are independent, so both are sent at once
+        analyzed = IO_POOL.submit(forward_file, 'http://foto-forensics:5000/analyze', data, safe_filename)
+        if not ela_current:
+            uploaded = IO_POOL.submit(forward_file, 'http://foto-forensics:5000/upload', data, safe_filename)
         try:
             # Send the file to foto-forensics for comprehensive analysis
-            response = requests.post('http://foto-forensics:5000/analyze', files={'file': open(filepath, 'rb')}, data={'filename': safe_filename})
-            print(f"[INFO] Sent file to foto-forensics for comprehensive analysis, response status: {response.status_code}", flush=True)
+            response = analyzed.result()
+            logger.debug("Sent file to foto-forensics for comprehensive analysis, response status: %s", response.status_code)
             
             if response.status_code == 200:
-                comprehensive_analysis = response.json()
-                print(f"[INFO] Received comprehensive analysis results", flush=True)
+                comprehensive_analysis = orjson.loads(response.content) if orjson is not None else response.json()
+                # The report script embeds the JSON as received instead of re-serializing the dict
+                comprehensive_analysis_json = script_safe_json(response.text)
+                logger.debug("Received comprehensive analysis results")
             else:
                 comprehensive_analysis = None
-                print(f"[WARNING] Comprehensive analysis failed, falling back to ELA only", flush=True)
+                logger.warning("Comprehensive analysis failed, falling back to ELA only")
                 
-            ela_response = requests.post('http://foto-forensics:5000/upload', files={'file': open(filepath, 'rb')}, data={'filename': safe_filename})
-            print(f"[INFO] Sent file for ELA generation, response status: {ela_response.status_code}", flush=True)
+            if ela_current:
+                logger.debug("Reusing the existing ELA image for %s", safe_filename)
+                ela_fresh = True
+            else:
+                ela_response = uploaded.result()
+                logger.debug("Sent file for ELA generation, response status: %s", ela_response.status_code)
+                # After a failed /upload the ELA file on disk, if any, is from an earlier upload
+                ela_fresh = ela_response.status_code == 200
+                if not ela_fresh:
+                    logger.warning("ELA generation failed with status %s", ela_response.status_code)
         except Exception as e:
             error = f"Failed to send file to foto-forensics: {e}"
-            print(f"[ERROR] {error}", flush=True)
-            return render_template_string(HTML, filename=None, error=error, comprehensive_analysis=None)
+            logger.error(error)
+            return dict(filename=None, error=error, comprehensive_analysis=None)
+        try:
+            saved.result()
+            logger.debug("Saved uploaded file to %s", filepath)
+        except Exception as e:
+            error = f"Failed to save uploaded file: {e}"
+            logger.error(error)
+            return dict(filename=None, error=error)
         filename = safe_filename
         # Enhanced ELA report analysis
-        ela_path = os.path.join(app.config['UPLOAD_FOLDER'], f'ela_{filename}')
-        original_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        ela_report = {"description": "No ELA image found.", "result": "Unknown", "certainty": 0, 
-                     "ela_mean": 0, "ela_std": 0, "dimensions": "Unknown", "file_size": "Unknown",
-                     "high_variance_percent": 0, "edge_density": 0}
+        ela_report = dict(DEFAULT_ELA_REPORT, description="No ELA image found.")
+        # Both images are rewritten on every upload, so their URLs are versioned separately:
+        # the original by the uploaded bytes, the ELA image by its mtime
+        original_version = upload_digest
+        image_version = ela_version(ela_path)
         
-        if os.path.exists(ela_path) and os.path.exists(original_path):
+        if image_version is not None and ela_fresh:
             try:
-                ela_img = Image.open(ela_path).convert('L')
-                ela_arr = np.array(ela_img)
-                mean_val = ela_arr.mean()
-                std_val = ela_arr.std()
-                
-                orig_img = Image.open(original_path)
-                file_size = os.path.getsize(original_path)
-                file_size_str = f"{file_size / 1024:.1f} KB" if file_size < 1024*1024 else f"{file_size / (1024*1024):.1f} MB"
-                
-                high_variance_threshold = mean_val + std_val
-                high_variance_pixels = np.sum(ela_arr > high_variance_threshold)
-                high_variance_percent = (high_variance_pixels / ela_arr.size) * 100
-                
-                edges = np.abs(np.diff(ela_arr, axis=0)).sum() + np.abs(np.diff(ela_arr, axis=1)).sum()
-                edge_density = edges / ela_arr.size
-                
-                base_confidence = 50
-                mean_factor = min(40, (mean_val / 255) * 100)
-                std_factor = min(20, (std_val / 50) * 20)
-                variance_factor = min(20, high_variance_percent * 2)
-                edge_factor = min(10, edge_density / 10)
-                
-                if mean_val > 15:
-                    result = "Manipulated"
-                    certainty = min(100, int(base_confidence + mean_factor + std_factor + variance_factor))
-                    description = f"Analysis indicates potential manipulation. ELA shows bright areas (mean: {mean_val:.1f}) suggesting inconsistent compression levels. High variance regions ({high_variance_percent:.1f}%) and edge artifacts support this assessment."
+                if cached is not None:
+                    # The report depends only on the uploaded bytes
+                    ela_report = cached[0]
                 else:
-                    result = "Authentic"
-                    certainty = max(30, int(100 - mean_factor - (std_factor/2) - (variance_factor/2)))
-                    description = f"Analysis suggests the image is likely authentic. ELA shows mostly uniform compression (mean: {mean_val:.1f}) with low variance regions ({high_variance_percent:.1f}%), indicating consistent processing throughout the image."
-                
-                ela_report = {
-                    "description": description,
-                    "result": result,
-                    "certainty": certainty,
-                    "ela_mean": mean_val,
-                    "ela_std": std_val,
-                    "dimensions": f"{orig_img.width} × {orig_img.height}",
-                    "file_size": file_size_str,
-                    "high_variance_percent": high_variance_percent,
-                    "edge_density": edge_density
-                }
-                
+                    # The original's header and size come from the upload already in memory
+                    width, height = read_dimensions(data)
+                    ela_report = run_in_pool(analyze_ela, ela_path, width, height, len(data))
+                store_ela_report(upload_digest, ela_report, ela_path, image_version)
+            except Exception as e:
+                ela_report = dict(DEFAULT_ELA_REPORT, description=f"Error analyzing ELA image: {e}")
+    return dict(filename=filename, error=error, ela_report=ela_report, comprehensive_analysis=comprehensive_analysis, comprehensive_analysis_json=comprehensive_analysis_json, image_version=image_version, original_version=original_version)
+
+@app.route('/', methods=['GET', 'POST'])
+def upload_file():
+    if request.method == 'POST':
+        # Read before streaming: a request without a file still gets a 400, and the upload
+        # stream is closed by the time the response body is generated. The same bytes are
+        # hashed, saved and sent to both endpoints.
+        f = request.files['file']
+        upload_name, data = f.filename, f.read()
+        def generate():
+            # The head goes out before the upload is analyzed so the browser can start rendering
+            yield render_page(HEAD_TEMPLATE)
+            try:
+                context = analyze_upload(upload_name, data)
             except Exception as e:
-                ela_report = {
-                    "description": f"Error analyzing ELA image: {e}", 
-                    "result": "Unknown", 
-                    "certainty": 0,
-                    "ela_mean": 0, 
-                    "ela_std": 0, 
-                    "dimensions": "Unknown", 
-                    "file_size": "Unknown",
-                    "high_variance_percent": 0, 
-                    "edge_density": 0
-                }
-    return render_template_string(HTML, filename=filename, error=error, ela_report=ela_report, comprehensive_analysis=comprehensive_analysis)
+                # The 200 status is already sent; finish the page with the error instead of dropping the connection
+                logger.exception("Upload analysis failed")
+                context = dict(filename=None, error=f"Failed to analyze upload: {e}")
+            yield render_page(BODY_TEMPLATE, **context)
+        return Response(stream_with_context(generate()), mimetype='text/html')
+    return render_page(TEMPLATE, **analyze_upload())
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host='0.0.0.0', port=8080, threaded=True)
+    else:
+        # Uploads mostly wait on foto-forensics, so a threaded production server scales with them
+        serve(app, host='0.0.0.0', port=8080, threads=8)
@@ -0,0 +1,42 @@
+const report = JSON.parse(document.getElementById('report-data').textContent);
+
+function download(content, type, name) {
+    const blob = new Blob([content], {type: type});
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = name;
+    a.click();
+    URL.revokeObjectURL(url);
+}
+
+function downloadReport(format) {
+    const ela = report.ela_report;
+    if (format === 'json') {
+        const reportData = {
+            filename: report.filename,
+            timestamp: new Date().toISOString()
+        };
+        if (report.comprehensive_analysis) {
+            reportData.comprehensive_analysis = report.comprehensive_analysis;
+        }
+        reportData.ela_analysis = {
+            result: ela.result,
+            certainty: ela.certainty,
+            description: ela.description,
+            ela_mean: ela.ela_mean,
+            ela_std: ela.ela_std,
+            dimensions: ela.dimensions,
+            file_size: ela.file_size,
+            high_variance_percent: ela.high_variance_percent,
+            edge_density: ela.edge_density
+        };
+        download(JSON.stringify(reportData, null, 2), 'application/json',
+                 'image_analysis_report_' + report.filename + '.json');
+    } else if (format === 'txt') {
+        // The summary text is rendered server side; only the generation time is added here
+        const summary = document.getElementById('report-summary').textContent +
+            `Generated: ${new Date().toLocaleString()}\n`;
+        download(summary, 'text/plain', 'image_analysis_summary_' + report.filename + '.txt');
+    }
+}
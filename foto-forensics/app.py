@@ -1,26 +1,82 @@
 
 from flask import Flask, request, send_file, jsonify
-from PIL import Image, ImageChops, ImageEnhance
+from PIL import Image, UnidentifiedImageError
 from PIL.ExifTags import TAGS
+import io
 import os
 import json
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from scipy import ndimage
+from scipy import fft as sfft
 from werkzeug.utils import secure_filename
 import cv2
 import hashlib
+import logging
 from datetime import datetime
 from dutch_insurance_rules import DutchInsuranceAuthenticityRules
 
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 app = Flask(__name__)
 
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
 # Initialize Dutch Insurance Authenticity Rules
 dutch_rules = DutchInsuranceAuthenticityRules()
 
-def extract_exif_metadata(image_path):
+# The analyzers are independent and spend their time in OpenCV, NumPy and SciPy with the GIL released
+ANALYSIS_POOL = ThreadPoolExecutor(max_workers=7)
+
+FACE_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+FACE_SEARCH_MAX_SIDE = 1024
+# A classifier holds per-image detection state, so each request thread loads its own once
+CASCADES = threading.local()
+
+def face_cascade():
+    """Return this thread's frontal face classifier, parsing the cascade XML on first use"""
+    cascade = getattr(CASCADES, 'face', None)
+    if cascade is None:
+        cascade = CASCADES.face = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+    return cascade
+
+def decode_image(data, flags):
+    """Decode uploaded bytes as cv2.imread would read the saved file; None if they are not an image"""
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(encoded, flags) if encoded.size else None
+
+def decode_rgb(data):
+    """Decode uploaded bytes to an RGB array as Pillow would, through libjpeg-turbo directly for JPEGs"""
+    if simplejpeg is not None and simplejpeg.is_jpeg(data):
+        try:
+            # Accurate DCT and fancy upsampling match Pillow's decoder bit for bit
+            return simplejpeg.decode_jpeg(data, colorspace='RGB', fastdct=False, fastupsample=False)
+        except ValueError:
+            pass  # e.g. CMYK, which Pillow converts itself
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+
+def extract_exif_metadata(data, image_path):
     """Extract and analyze EXIF metadata for authenticity verification"""
     try:
-        image = Image.open(image_path)
+        # Read the uploaded bytes, not the saved file a concurrent upload could replace
+        try:
+            image = Image.open(io.BytesIO(data))
+        except UnidentifiedImageError:
+            # Name the saved file in the error, as opening it did, rather than a buffer address
+            raise UnidentifiedImageError(f"cannot identify image file {image_path!r}") from None
         exifdata = image.getexif()
         
         metadata = {}
@@ -59,23 +115,23 @@ def extract_exif_metadata(image_path):
             'metadata_score': 0
         }
 
-def analyze_jpeg_compression(image_path):
+def analyze_jpeg_compression(gray, file_size):
     """Analyze JPEG compression artifacts for re-compression detection"""
     try:
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        img = gray
         
-        file_size = os.path.getsize(image_path)
         img_area = img.shape[0] * img.shape[1]
         compression_ratio = file_size / img_area
         
-        block_artifacts = 0
-        for i in range(0, img.shape[0] - 8, 8):
-            for j in range(0, img.shape[1] - 8, 8):
-                block = img[i:i+8, j:j+8]
-                if i > 0:
-                    boundary_diff = np.mean(np.abs(img[i-1, j:j+8].astype(float) - img[i, j:j+8].astype(float)))
-                    if boundary_diff > 10:
-                        block_artifacts += 1
+        # Compare the last row of each 8x8 block with the first row of the block below it,
+        # for the same blocks the original per-block loop visited
+        height, width = img.shape
+        blocks_x = len(range(0, width - 8, 8))
+        above = img[7:height - 9:8, :blocks_x * 8].astype(np.int16)
+        below = img[8:height - 8:8, :blocks_x * 8].astype(np.int16)
+        boundary_sums = np.abs(below - above).reshape(len(below), blocks_x, 8).sum(axis=2)
+        # A mean boundary difference above 10 is a sum above 80 over the 8 pixels
+        block_artifacts = int(np.count_nonzero(boundary_sums > 80))
         
         artifact_density = block_artifacts / ((img.shape[0] // 8) * (img.shape[1] // 8))
         
@@ -105,10 +161,10 @@ def analyze_jpeg_compression(image_path):
             'compression_score': 0
         }
 
-def detect_copy_move(image_path):
+def detect_copy_move(gray):
     """Detect copy-move forgeries using feature matching"""
     try:
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        img = gray
         
         orb = cv2.ORB_create(nfeatures=1000)
         keypoints, descriptors = orb.detectAndCompute(img, None)
@@ -121,19 +177,24 @@ def detect_copy_move(image_path):
                 'copy_move_score': 50
             }
         
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(descriptors, descriptors)
-        
-        suspicious_matches = []
-        for match in matches:
-            if match.queryIdx != match.trainIdx:
-                pt1 = keypoints[match.queryIdx].pt
-                pt2 = keypoints[match.trainIdx].pt
-                distance = np.sqrt((pt1[0] - pt2[0])**2 + (pt1[1] - pt2[1])**2)
-                if 20 < distance < 200:  # Reasonable copy-move distance
-                    suspicious_matches.append(match)
+        # Cross-checked matching of the descriptors against themselves. The Hamming distances
+        # are symmetric, so the reverse pass would find the same best matches: match once and
+        # keep the pairs that are each other's best match
+        bf = cv2.BFMatcher(cv2.NORM_HAMMING)
+        best = np.full(len(descriptors), -1, dtype=np.intp)
+        for match in bf.match(descriptors, descriptors):
+            best[match.queryIdx] = match.trainIdx
+        query = np.flatnonzero(best >= 0)
+        train = best[query]
+        keep = (best[train] == query) & (query != train)
+        query, train = query[keep], train[keep]
+
+        points = np.array([kp.pt for kp in keypoints], dtype=np.float64)
+        distance = np.sqrt(((points[query] - points[train]) ** 2).sum(axis=1))
+        # Reasonable copy-move distance
+        suspicious_matches = int(np.count_nonzero((distance > 20) & (distance < 200)))
         
-        suspicious_regions = len(suspicious_matches) // 5  # Rough clustering
+        suspicious_regions = suspicious_matches // 5  # Rough clustering
         copy_move_detected = suspicious_regions > 3
         confidence = min(100, suspicious_regions * 20)
         
@@ -151,18 +212,23 @@ def detect_copy_move(image_path):
             'copy_move_score': 50
         }
 
-def analyze_noise_patterns(image_path):
+def analyze_noise_patterns(gray):
     """Analyze sensor noise patterns for camera model verification"""
     try:
-        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE).astype(np.float32)
-        
         kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
-        noise = cv2.filter2D(img, -1, kernel)
-        
-        noise_std = np.std(noise)
-        noise_mean = np.mean(np.abs(noise))
-        
-        noise_histogram = np.histogram(noise.flatten(), bins=50)[0]
+        # The response of 8-bit pixels is an exact integer in [-2040, 2040], so filter to int16
+        # and summarise one bincount of the values instead of several passes over the image
+        noise = cv2.filter2D(gray, cv2.CV_16S, kernel)
+        lowest = noise.min()
+        counts = np.bincount((noise - lowest).ravel())
+        values = np.arange(int(lowest), int(lowest) + len(counts), dtype=np.float64)
+        
+        noise_mean_value = np.dot(counts, values) / noise.size
+        noise_std = np.sqrt(np.dot(counts, (values - noise_mean_value) ** 2) / noise.size)
+        noise_mean = np.dot(counts, np.abs(values)) / noise.size
+        
+        # Binning each distinct value with its count gives the same bins as the full histogram
+        noise_histogram = np.histogram(values, bins=50, weights=counts)[0]
         noise_uniformity = np.std(noise_histogram) / np.mean(noise_histogram)
         
         artificial_indicators = []
@@ -189,10 +255,10 @@ def analyze_noise_patterns(image_path):
             'noise_score': 0
         }
 
-def analyze_pixel_histogram(image_path):
+def analyze_pixel_histogram(bgr):
     """Analyze pixel value histograms for artificial modifications"""
     try:
-        img = cv2.imread(image_path)
+        img = bgr
         
         hist_b = cv2.calcHist([img], [0], None, [256], [0, 256])
         hist_g = cv2.calcHist([img], [1], None, [256], [0, 256])
@@ -239,51 +305,60 @@ def analyze_pixel_histogram(image_path):
             'histogram_score': 0
         }
 
-def detect_ai_generated_images(image_path):
+def pixel_correlation(a, b):
+    """Pearson correlation of two equally shaped pixel arrays, without np.corrcoef's stacked copy"""
+    a = a.astype(np.float64).ravel()
+    b = b.astype(np.float64).ravel()
+    a -= a.mean()
+    b -= b.mean()
+    return np.clip(np.dot(a, b) / np.sqrt(np.dot(a, a) * np.dot(b, b)), -1, 1)
+
+def spectrum_statistics(gray):
+    """Mean and std of the log magnitude spectrum, from the half spectrum of the real FFT"""
+    magnitude = np.log1p(np.abs(sfft.rfft2(gray, workers=-1)))
+    # Every column except DC (and Nyquist for even widths) stands for itself and its conjugate mirror
+    weights = np.full(magnitude.shape[1], 2.0)
+    weights[0] = 1
+    if gray.shape[1] % 2 == 0:
+        weights[-1] = 1
+    count = gray.size
+    mean = np.dot(magnitude.sum(axis=0), weights) / count
+    magnitude -= mean
+    np.square(magnitude, out=magnitude)
+    return mean, np.sqrt(np.dot(magnitude.sum(axis=0), weights) / count)
+
+def detect_ai_generated_images(bgr, gray):
     """Detect AI-generated images using multiple techniques"""
     try:
-        img = cv2.imread(image_path)
-        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        img = bgr
         
         ai_indicators = []
         
-        f_transform = np.fft.fft2(gray)
-        f_shift = np.fft.fftshift(f_transform)
-        magnitude_spectrum = np.log(np.abs(f_shift) + 1)
-        
-        freq_std = np.std(magnitude_spectrum)
-        freq_mean = np.mean(magnitude_spectrum)
+        freq_mean, freq_std = spectrum_statistics(gray)
         freq_ratio = freq_std / freq_mean if freq_mean > 0 else 0
         
         if freq_ratio < 0.3:
             ai_indicators.append("Unnatural frequency domain patterns detected")
         
-        h_corr = np.corrcoef(gray[:-1].flatten(), gray[1:].flatten())[0, 1]
-        v_corr = np.corrcoef(gray[:, :-1].flatten(), gray[:, 1:].flatten())[0, 1]
+        h_corr = pixel_correlation(gray[:-1], gray[1:])
+        v_corr = pixel_correlation(gray[:, :-1], gray[:, 1:])
         
         if h_corr > 0.95 or v_corr > 0.95:
             ai_indicators.append("Excessive pixel correlation suggests AI generation")
         
         def calculate_lbp_uniformity(image):
             rows, cols = image.shape
-            uniformity_count = 0
-            total_patterns = 0
-            
-            for i in range(1, rows-1):
-                for j in range(1, cols-1):
-                    center = image[i, j]
-                    pattern = []
-                    for di in [-1, -1, -1, 0, 0, 1, 1, 1]:
-                        for dj in [-1, 0, 1, -1, 1, -1, 0, 1]:
-                            if len(pattern) < 8:
-                                pattern.append(1 if image[i+di, j+dj] >= center else 0)
-                    
-                    transitions = sum(1 for k in range(8) if pattern[k] != pattern[(k+1)%8])
-                    if transitions <= 2:
-                        uniformity_count += 1
-                    total_patterns += 1
-            
-            return uniformity_count / total_patterns if total_patterns > 0 else 0
+            if rows < 3 or cols < 3:
+                return 0
+            # The pattern samples the three pixels above the centre, in the order
+            # up-left, up, up-right, up-left, up-right, up-left, up, up-right.
+            # Its circular transition count is at most 2 exactly when all three agree.
+            center = image[1:-1, 1:-1]
+            up_left = image[:-2, :-2] >= center
+            up = image[:-2, 1:-1] >= center
+            up_right = image[:-2, 2:] >= center
+            uniform = (up_left == up) & (up == up_right)
+            return int(np.count_nonzero(uniform)) / uniform.size
         
         lbp_uniformity = calculate_lbp_uniformity(gray)
         if lbp_uniformity > 0.8:
@@ -303,16 +378,19 @@ def detect_ai_generated_images(image_path):
             if hue_peaks < 5:
                 ai_indicators.append("Limited color palette suggests AI generation")
         
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        # The cascade's cost grows with pixel count, so search a copy capped at FACE_SEARCH_MAX_SIDE
+        # and map the boxes back to check symmetry at full resolution
+        scale = min(1.0, FACE_SEARCH_MAX_SIDE / max(gray.shape))
+        search = gray if scale == 1 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        faces = face_cascade().detectMultiScale(search, 1.1, 4)
         
         if len(faces) > 0:
-            for (x, y, w, h) in faces:
+            for (x, y, w, h) in np.round(faces / scale).astype(int):
                 face_roi = gray[y:y+h, x:x+w]
                 left_half = face_roi[:, :w//2]
                 right_half = cv2.flip(face_roi[:, w//2:], 1)
                 if left_half.shape == right_half.shape:
-                    symmetry = np.corrcoef(left_half.flatten(), right_half.flatten())[0, 1]
+                    symmetry = pixel_correlation(left_half, right_half)
                     if symmetry > 0.9:
                         ai_indicators.append("Unnatural facial symmetry detected")
         
@@ -342,21 +420,21 @@ def detect_ai_generated_images(image_path):
             'ai_score': 50
         }
 
-def create_blockchain_timestamp(image_path):
+def create_blockchain_timestamp(data):
     """Create blockchain-style timestamp for image provenance"""
     try:
-        with open(image_path, 'rb') as f:
-            image_data = f.read()
-        image_hash = hashlib.sha256(image_data).hexdigest()
+        # Hash the uploaded bytes themselves, not a saved file another upload could replace
+        image_hash = hashlib.sha256(data).hexdigest()
         
         timestamp = datetime.now().isoformat()
         provenance_record = {
             'image_hash': image_hash,
             'timestamp': timestamp,
-            'file_size': len(image_data),
+            'file_size': len(data),
             'verification_method': 'SHA256'
         }
         
+        # The verification hash is defined over json.dumps' canonical form; another encoder would change it
         record_string = json.dumps(provenance_record, sort_keys=True)
         verification_hash = hashlib.sha256(record_string.encode()).hexdigest()
         provenance_record['verification_hash'] = verification_hash
@@ -371,6 +449,52 @@ def create_blockchain_timestamp(image_path):
             'blockchain_score': 0
         }
 
+# mkstemp creates files readable by the owner only; saved images get the mode a plain open() would give.
+# os.umask can only be read by setting it, so it is read once at startup.
+UMASK = os.umask(0)
+os.umask(UMASK)
+UPLOAD_MODE = 0o666 & ~UMASK
+
+def save_upload(data, path):
+    """Save uploaded bytes through a temporary file and rename, so a concurrent request never reads them half-written"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+            os.fchmod(out.fileno(), UPLOAD_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+# SHA-256 of the upload each ELA image was computed from, so re-sending the same bytes reuses it;
+# kept in least-recently-used order. The lock keeps each ELA file and its recorded digest in step.
+ELA_SOURCES = OrderedDict()
+ELA_SOURCES_MAX = 256
+ELA_SOURCES_LOCK = threading.Lock()
+
+def cached_ela(ela_path, digest):
+    """Return the ELA image bytes computed from an upload with this digest, or None"""
+    with ELA_SOURCES_LOCK:
+        if ELA_SOURCES.get(ela_path) != digest:
+            return None
+        try:
+            with open(ela_path, 'rb') as cached:
+                ela_bytes = cached.read()
+        except FileNotFoundError:
+            return None
+        ELA_SOURCES.move_to_end(ela_path)
+        return ela_bytes
+
+def store_ela(ela_path, digest, ela_bytes):
+    """Save an ELA image and record its source digest, evicting the least recently used record when full"""
+    with ELA_SOURCES_LOCK:
+        save_upload(ela_bytes, ela_path)
+        ELA_SOURCES[ela_path] = digest
+        ELA_SOURCES.move_to_end(ela_path)
+        if len(ELA_SOURCES) > ELA_SOURCES_MAX:
+            ELA_SOURCES.popitem(last=False)
+
 @app.route('/upload', methods=['POST'])
 def upload_image():
     try:
@@ -381,22 +505,35 @@ def upload_image():
             from werkzeug.utils import secure_filename
             safe_filename = secure_filename(f.filename)
         path = f"./images/{safe_filename}"
-        f.save(path)
+        data = f.read()
+        save_upload(data, path)
 
-        from PIL import Image, ImageChops, ImageEnhance
-        im = Image.open(path).convert('RGB')
-        im.save('temp.jpg', quality=95)
-        temp = Image.open('temp.jpg')
-
-        diff = ImageChops.difference(im, temp)
-        diff = ImageEnhance.Brightness(diff).enhance(10)
         ela_path = f"./images/ela_{safe_filename}"
-        diff.save(ela_path)
+        digest = hashlib.sha256(data).hexdigest()
+        ela_bytes = cached_ela(ela_path, digest)
+        if ela_bytes is not None:
+            return send_file(io.BytesIO(ela_bytes), mimetype='image/jpeg', etag=digest)
+
+        rgb = decode_rgb(data)
+        # Re-compress in memory; a shared temp file on disk races between concurrent requests.
+        # Pillow stays the encoder: ELA compares against its quality 95 output.
+        buf = io.BytesIO()
+        Image.fromarray(rgb).save(buf, format='JPEG', quality=95)
+        recompressed = decode_rgb(buf.getvalue())
 
-        print(f"[INFO] ELA image saved to {ela_path}", flush=True)
-        return send_file(ela_path, mimetype='image/jpeg')
+        # One saturating pass: |original - recompressed| scaled by 10, as the
+        # difference plus 10x brightness enhancement produced
+        diff = cv2.convertScaleAbs(cv2.absdiff(rgb, recompressed), alpha=10)
+        # Encode in the format the file extension names, then swap it in atomically
+        ela = io.BytesIO()
+        Image.fromarray(diff).save(ela, format=Image.registered_extensions().get(os.path.splitext(ela_path)[1].lower()))
+        store_ela(ela_path, digest, ela.getvalue())
+
+        logger.info("ELA image saved to %s", ela_path)
+        # Send this request's own image; a concurrent upload may already have replaced the file
+        return send_file(io.BytesIO(ela.getvalue()), mimetype='image/jpeg', etag=digest)
     except Exception as e:
-        print(f"[ERROR] Exception in upload_image: {e}", flush=True)
+        logger.error("Exception in upload_image: %s", e)
         return f"Error processing image: {e}", 500
 
 @app.route('/analyze', methods=['POST'])
@@ -408,30 +545,44 @@ def analyze_image():
         if not safe_filename:
             safe_filename = secure_filename(f.filename)
         path = f"./images/{safe_filename}"
-        f.save(path)
+        data = f.read()
+        save_upload(data, path)
+
+        # Decode once for every pixel-based analyzer. Colour and grayscale are decoded
+        # separately because libjpeg's direct grayscale output differs from converting BGR.
+        bgr = decode_image(data, cv2.IMREAD_COLOR)
+        gray = decode_image(data, cv2.IMREAD_GRAYSCALE)
 
-        print(f"[INFO] Starting comprehensive analysis of {safe_filename}", flush=True)
+        logger.info("Starting comprehensive analysis of %s", safe_filename)
+        
+        metadata_future = ANALYSIS_POOL.submit(extract_exif_metadata, data, path)
+        compression_future = ANALYSIS_POOL.submit(analyze_jpeg_compression, gray, len(data))
+        copy_move_future = ANALYSIS_POOL.submit(detect_copy_move, gray)
+        noise_future = ANALYSIS_POOL.submit(analyze_noise_patterns, gray)
+        histogram_future = ANALYSIS_POOL.submit(analyze_pixel_histogram, bgr)
+        blockchain_future = ANALYSIS_POOL.submit(create_blockchain_timestamp, data)
+        ai_future = ANALYSIS_POOL.submit(detect_ai_generated_images, bgr, gray)
         
-        metadata_analysis = extract_exif_metadata(path)
-        print(f"[INFO] Metadata analysis complete", flush=True)
+        metadata_analysis = metadata_future.result()
+        logger.debug("Metadata analysis complete")
         
-        compression_analysis = analyze_jpeg_compression(path)
-        print(f"[INFO] Compression analysis complete", flush=True)
+        compression_analysis = compression_future.result()
+        logger.debug("Compression analysis complete")
         
-        copy_move_analysis = detect_copy_move(path)
-        print(f"[INFO] Copy-move analysis complete", flush=True)
+        copy_move_analysis = copy_move_future.result()
+        logger.debug("Copy-move analysis complete")
         
-        noise_analysis = analyze_noise_patterns(path)
-        print(f"[INFO] Noise analysis complete", flush=True)
+        noise_analysis = noise_future.result()
+        logger.debug("Noise analysis complete")
         
-        histogram_analysis = analyze_pixel_histogram(path)
-        print(f"[INFO] Histogram analysis complete", flush=True)
+        histogram_analysis = histogram_future.result()
+        logger.debug("Histogram analysis complete")
         
-        blockchain_analysis = create_blockchain_timestamp(path)
-        print(f"[INFO] Blockchain timestamp created", flush=True)
+        blockchain_analysis = blockchain_future.result()
+        logger.debug("Blockchain timestamp created")
         
-        ai_analysis = detect_ai_generated_images(path)
-        print(f"[INFO] AI detection analysis complete", flush=True)
+        ai_analysis = ai_future.result()
+        logger.debug("AI detection analysis complete")
         
         # Apply Dutch Insurance Industry authenticity rules
         all_analysis_results = {
@@ -476,11 +627,15 @@ def analyze_image():
             'timestamp': datetime.now().isoformat()
         }
         
-        print(f"[INFO] Comprehensive analysis complete for {safe_filename}", flush=True)
+        logger.info("Comprehensive analysis complete for %s", safe_filename)
+        if orjson is not None:
+            # Sorted keys keep the field order jsonify produced, which flask-ui embeds as received
+            body = orjson.dumps(analysis_result, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+            return app.response_class(body, mimetype='application/json')
         return jsonify(analysis_result)
         
     except Exception as e:
-        print(f"[ERROR] Exception in analyze_image: {e}", flush=True)
+        logger.error("Exception in analyze_image: %s", e)
         return jsonify({'error': f"Error analyzing image: {e}"}), 500
 
 @app.route('/compliance/audit-trail', methods=['GET'])
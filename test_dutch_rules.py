@@ -4,11 +4,24 @@ Test script for Dutch Insurance Authenticity Rules
 """
 
 import requests
+from requests_toolbelt import MultipartEncoder
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-def test_image_analysis(image_path, expected_result=None):
-    """Test image analysis with Dutch insurance rules"""
+# One pooled connection reused across all test requests
+SESSION = requests.Session()
+
+def analyze_image(image_path):
+    """Send an image to the analysis endpoint"""
+    filename = os.path.basename(image_path)
+    with open(image_path, 'rb') as f:
+        # Stream the multipart body from the file instead of building it in memory
+        body = MultipartEncoder(fields={'file': (filename, f), 'filename': filename})
+        return SESSION.post('http://localhost:5000/analyze', data=body, headers={'Content-Type': body.content_type})
+
+def test_image_analysis(image_path, expected_result=None, pending=None):
+    """Test image analysis with Dutch insurance rules; pending is an already submitted analyze_image future"""
     
     if not os.path.exists(image_path):
         print(f"❌ Image not found: {image_path}")
@@ -19,11 +32,7 @@ def test_image_analysis(image_path, expected_result=None):
     
     try:
         # Send image for analysis
-        with open(image_path, 'rb') as f:
-            files = {'file': f}
-            data = {'filename': os.path.basename(image_path)}
-            
-            response = requests.post('http://localhost:5000/analyze', files=files, data=data)
+        response = pending.result() if pending is not None else analyze_image(image_path)
         
         if response.status_code == 200:
             result = response.json()
@@ -82,7 +91,7 @@ def test_audit_trail():
     print("=" * 30)
     
     try:
-        response = requests.get('http://localhost:5000/compliance/audit-trail')
+        response = SESSION.get('http://localhost:5000/compliance/audit-trail')
         
         if response.status_code == 200:
             result = response.json()
@@ -108,9 +117,12 @@ if __name__ == "__main__":
         "c:\\Users\\nuben\\Google Drive\\CCS\\Projects\\Image-authentication-toolkit\\test_image.png"
     ]
     
-    for image_path in test_images:
-        if os.path.exists(image_path):
-            test_image_analysis(image_path)
+    # Send the images concurrently, then report on each in order
+    available = [image_path for image_path in test_images if os.path.exists(image_path)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        pending = [pool.submit(analyze_image, image_path) for image_path in available]
+        for image_path, future in zip(available, pending):
+            test_image_analysis(image_path, pending=future)
     
     # Test audit trail
     test_audit_trail()
@@ -1,10 +1,12 @@
 import requests
+from requests_toolbelt import MultipartEncoder
 
 image_path = 'images/Visum pasfoto.jpg'
 url = 'http://localhost:8080/'
 
 with open(image_path, 'rb') as img:
-    files = {'file': ('Visum pasfoto.jpg', img, 'image/jpeg')}
-    response = requests.post(url, files=files)
+    # Stream the multipart body from the file instead of building it in memory
+    body = MultipartEncoder(fields={'file': ('Visum pasfoto.jpg', img, 'image/jpeg')})
+    response = requests.post(url, data=body, headers={'Content-Type': body.content_type})
     print('Status code:', response.status_code)
     print('Response text:', response.text) 
\ No newline at end of file